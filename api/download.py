@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+import logging
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from info import get_video_info
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Formats that need merging or conversion are handed to the full backend
+BACKEND_API_URL = os.environ.get('BACKEND_API_URL', '').rstrip('/')
+AUDIO_FORMATS = ('mp3', 'm4a')
+
+def json_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body)
+    }
+
+def select_direct_format(formats, format_type):
+    """Pick the directly playable format for a request, if there is one"""
+    if format_type == 'best':
+        candidates = [fmt for fmt in formats if fmt.get('has_audio') and fmt.get('direct')]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda fmt: (fmt.get('height') or 0, fmt.get('filesize') or 0))
+
+    for fmt in formats:
+        if fmt.get('format_id') == format_type:
+            return fmt if fmt.get('direct') else None
+    return None
+
+def queue_backend_download(url, format_type, title):
+    """Fall back to a download job on the full backend"""
+    if not BACKEND_API_URL:
+        return json_response(422, {
+            'error': 'This format needs server-side processing and no backend is configured'
+        })
+
+    response = requests.post(
+        f'{BACKEND_API_URL}/download',
+        json={'url': url, 'format': format_type, 'title': title},
+        timeout=20
+    )
+    body = response.json()
+    if response.ok:
+        body['mode'] = 'backend'
+        body['api_url'] = BACKEND_API_URL
+    return json_response(response.status_code, body)
+
+def handler(request):
+    if request.method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type'
+            },
+            'body': ''
+        }
+
+    if request.method != 'POST':
+        return json_response(405, {'error': 'Method not allowed'})
+
+    try:
+        body = json.loads(request.body)
+        url = body.get('url')
+        format_type = body.get('format', 'best')
+        title = body.get('title', 'video')
+
+        if not url:
+            return json_response(400, {'error': 'URL is required'})
+
+        if format_type in AUDIO_FORMATS:
+            return queue_backend_download(url, format_type, title)
+
+        info = get_video_info(url)
+        if not info:
+            return json_response(400, {'error': 'Could not extract video information'})
+
+        fmt = select_direct_format(info.get('formats', []), format_type)
+        if not fmt:
+            logger.info(f"No direct format for {url} ({format_type}), using backend")
+            return queue_backend_download(url, format_type, info.get('title', title))
+
+        # Hand the origin URL to the client so bytes never pass through here
+        logger.info(f"Redirecting to origin for {url} ({fmt['format_id']})")
+        return json_response(200, {
+            'mode': 'redirect',
+            'url': fmt['url'],
+            'format_id': fmt['format_id'],
+            'ext': fmt.get('ext', ''),
+            'filesize': fmt.get('filesize') or 0,
+            'title': info.get('title', title)
+        })
+
+    except Exception as e:
+        logger.error(f"Error in download: {str(e)}")
+        return json_response(500, {'error': str(e)})
@@ -1,11 +1,31 @@
 import json
 import yt_dlp
 import logging
+from urllib.parse import urlparse, parse_qs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DIRECT_PROTOCOLS = ('http', 'https')
+# Request headers a browser won't send for a plain cross-site download
+SESSION_HEADERS = ('cookie', 'referer', 'origin', 'authorization')
+
+def is_direct(fmt):
+    """Check whether a yt-dlp format is a single file the client can fetch itself"""
+    media_url = fmt.get('url')
+    if not media_url or (fmt.get('protocol') or 'https') not in DIRECT_PROTOCOLS:
+        return False
+    # The origin only serves formats that need cookies or session headers to
+    # the extractor, not to a redirected client
+    if fmt.get('cookies'):
+        return False
+    headers = fmt.get('http_headers') or {}
+    if any(name.lower() in SESSION_HEADERS for name in headers):
+        return False
+    # Some CDNs (e.g. YouTube) sign media URLs for the extracting IP only
+    return 'ip' not in parse_qs(urlparse(media_url).query)
+
 def get_video_info(url):
     """Extract video information without downloading"""
     ydl_opts = {
@@ -40,6 +60,8 @@ def get_video_info(url):
                         'vcodec': fmt.get('vcodec', ''),
                         'acodec': fmt.get('acodec', ''),
                         'has_audio': has_audio,
+                        'url': fmt.get('url', ''),
+                        'direct': is_direct(fmt),
                     })
             
             # If no formats found, try to get at least one format
@@ -47,6 +69,7 @@ def get_video_info(url):
                 # Take the first format with video
                 for fmt in formats:
                     if fmt.get('vcodec') and fmt.get('vcodec') != 'none':
+                        has_audio = fmt.get('acodec') and fmt.get('acodec') != 'none'
                         processed_formats.append({
                             'format_id': fmt.get('format_id', ''),
                             'ext': fmt.get('ext', ''),
@@ -57,6 +80,8 @@ def get_video_info(url):
                             'vcodec': fmt.get('vcodec', ''),
                             'acodec': fmt.get('acodec', ''),
                             'has_audio': has_audio,
+                            'url': fmt.get('url', ''),
+                            'direct': is_direct(fmt),
                         })
                         break
             
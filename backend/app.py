@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 import yt_dlp
 import os
@@ -13,24 +13,154 @@ import json
 import cloudscraper
 import time
 import requests
+import copy
+import subprocess
+import shutil
+import hashlib
+import html
+import sqlite3
+import math
+from contextlib import closing
+from io import BytesIO
+from collections import deque, OrderedDict
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from requests.adapters import HTTPAdapter
+from PIL import Image
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['Retry-After'])
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create downloads directory
-DOWNLOADS_DIR = Path('downloads')
+DOWNLOADS_DIR = Path(os.environ.get('DOWNLOADS_DIR', 'downloads'))
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
+# Each job downloads into its own workspace under WORK_DIR and the finished
+# file is moved to DOWNLOADS_DIR/<download_id>/ with an atomic rename
+WORK_DIR = DOWNLOADS_DIR / '.work'
+WORK_DIR.mkdir(exist_ok=True)
+
 # Global variables for tracking downloads
 download_progress = {}
 download_files = {}
 
+# Post-processing (merge, remux, audio extraction) runs in its own process pool
+# so CPU-bound ffmpeg work never competes with the download threads
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', os.cpu_count() or 1))
+AUDIO_FORMATS = {'mp3': 'libmp3lame', 'm4a': 'aac'}
+postprocess_jobs = {}
+_postprocess_pool = None
+_postprocess_lock = threading.Lock()
+
+# Fragment concurrency for segmented (HLS/DASH) streams is tuned per host from
+# observed throughput and fragment error rate, within a per-host cap
+FRAGMENT_START_CONCURRENCY = int(os.environ.get('FRAGMENT_START_CONCURRENCY', 4))
+FRAGMENT_MAX_CONCURRENCY = int(os.environ.get('FRAGMENT_MAX_CONCURRENCY', 16))
+FRAGMENT_HOST_LIMIT = int(os.environ.get('FRAGMENT_HOST_LIMIT', 32))
+FRAGMENT_ERROR_THRESHOLD = float(os.environ.get('FRAGMENT_ERROR_THRESHOLD', 0.05))
+FRAGMENT_ERROR_PATTERN = re.compile(r'Got error|Retrying fragment|Skipping fragment')
+fragment_stats = {}
+
+# Admission control: /api/download is refused with 429/503 and a Retry-After
+# instead of accepting work the server can't finish. A limit of 0 disables it.
+ADMISSION_MAX_JOBS = int(os.environ.get('ADMISSION_MAX_JOBS', 20))
+ADMISSION_MAX_INFLIGHT_BYTES = int(os.environ.get('ADMISSION_MAX_INFLIGHT_BYTES', 4 * 1024 * 1024 * 1024))
+ADMISSION_MIN_FREE_DISK_BYTES = int(os.environ.get('ADMISSION_MIN_FREE_DISK_BYTES', 1024 * 1024 * 1024))
+ADMISSION_MAX_RSS_BYTES = int(os.environ.get('ADMISSION_MAX_RSS_BYTES', 2 * 1024 * 1024 * 1024))
+ADMISSION_DEFAULT_JOB_BYTES = int(os.environ.get('ADMISSION_DEFAULT_JOB_BYTES', 100 * 1024 * 1024))
+ADMISSION_MAX_RETRY_AFTER = int(os.environ.get('ADMISSION_MAX_RETRY_AFTER', 300))
+admitted_jobs = {}
+average_job_seconds = 30.0
+_admission_lock = threading.Lock()
+
+# Progressive /api/info: basic metadata comes from oEmbed or Open Graph tags in
+# one round trip while the full format list is extracted in the background
+INFO_FAST_TIMEOUT = float(os.environ.get('INFO_FAST_TIMEOUT', 5))
+INFO_FAST_MAX_BYTES = int(os.environ.get('INFO_FAST_MAX_BYTES', 512 * 1024))
+INFO_JOB_TTL = int(os.environ.get('INFO_JOB_TTL', 600))
+OEMBED_ENDPOINTS = {
+    'vimeo.com': 'https://vimeo.com/api/oembed.json',
+    'tiktok.com': 'https://www.tiktok.com/oembed',
+    'dailymotion.com': 'https://www.dailymotion.com/services/oembed',
+}
+info_jobs = {}
+_info_jobs_lock = threading.Lock()
+
+# Job queue: 'local' runs downloads as threads in the API process, 'sqlite' and
+# 'redis' hand them to standalone workers (python -m backend.worker) that share
+# the queue and DOWNLOADS_DIR with the API
+JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'local').lower()
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', 'jobs.sqlite3')
+JOB_QUEUE_URL = os.environ.get('JOB_QUEUE_URL', 'redis://localhost:6379/0')
+JOB_LEASE = int(os.environ.get('JOB_LEASE', 60))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 24 * 60 * 60))
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+# Speculative prefetch: optionally start downloading the most likely format
+# right after /api/info so a later /api/download can attach to it
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PREFETCH_FORMAT = os.environ.get('PREFETCH_FORMAT', 'best')
+PREFETCH_MAX_CONCURRENT = int(os.environ.get('PREFETCH_MAX_CONCURRENT', 2))
+PREFETCH_MAX_BYTES = int(os.environ.get('PREFETCH_MAX_BYTES', 1024 * 1024 * 1024))
+PREFETCH_MAX_FILE_BYTES = int(os.environ.get('PREFETCH_MAX_FILE_BYTES', 256 * 1024 * 1024))
+PREFETCH_TTL = int(os.environ.get('PREFETCH_TTL', 300))
+PREFETCH_NICE = int(os.environ.get('PREFETCH_NICE', 10))
+prefetch_jobs = {}
+prefetch_reservations = {}
+cancelled_downloads = set()
+_prefetch_lock = threading.Lock()
+
 INSTAGRAM_COOKIES_FILE = 'cookies_insta.txt'
 
+# Shared connection pool for plain upstream HTTP fetches (thumbnails etc.)
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))
+_upstream_session = None
+_upstream_lock = threading.Lock()
+
+# Thumbnail proxy: origin thumbnails are fetched once, downscaled to the width
+# the UI displays and kept in a memory LRU backed by a size-bounded disk LRU
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 400))
+THUMBNAIL_MEMORY_CACHE_BYTES = int(os.environ.get('THUMBNAIL_MEMORY_CACHE_BYTES', 16 * 1024 * 1024))
+THUMBNAIL_DISK_CACHE_BYTES = int(os.environ.get('THUMBNAIL_DISK_CACHE_BYTES', 128 * 1024 * 1024))
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.environ.get('THUMBNAIL_MAX_SOURCE_BYTES', 5 * 1024 * 1024))
+THUMBNAIL_CACHE_DIR = Path('thumbnails')
+THUMBNAIL_CACHE_DIR.mkdir(exist_ok=True)
+thumbnail_sources = {}
+thumbnail_memory_cache = OrderedDict()
+thumbnail_disk_bytes = None  # Scanned from THUMBNAIL_CACHE_DIR on first write
+_thumbnail_lock = threading.Lock()
+_thumbnail_disk_lock = threading.Lock()
+
+# Negative-result cache: permanent extraction failures (private, deleted,
+# unsupported) are answered from memory for a short while instead of re-running
+# the full extraction. Temporary network errors are never cached.
+NEGATIVE_CACHE_TTL = int(os.environ.get('NEGATIVE_CACHE_TTL', 600))
+NEGATIVE_CACHE_RATE_LIMIT_TTL = int(os.environ.get('NEGATIVE_CACHE_RATE_LIMIT_TTL', 60))
+NEGATIVE_CACHE_SIZE = int(os.environ.get('NEGATIVE_CACHE_SIZE', 1000))
+NEGATIVE_RESULT_PATTERNS = [
+    # YouTube's bot check is tied to the server's IP and passes, so it is
+    # treated like a rate limit rather than a login wall
+    ('rate_limited', r"HTTP Error 429|: 429\b|Too Many Requests|rate[- ]?limit|Sign in to confirm you.re not a bot"),
+    ('login_required', r'Sign in to confirm your age|[Ll]ogin required|[Yy]ou need to log in|[Ll]og in to (?:view|watch|access)|Private video|This video is private|requires authentication|members[- ]only'),
+    ('not_found', r'HTTP Error 404|: 404\b|Video unavailable|has been removed|does not exist|no longer available|This video is not available'),
+    ('unsupported', r'Unsupported URL|is not a valid URL|No video formats found|There is no video in this post'),
+]
+# Failures caused by the requested content rather than by the extractor
+CONTENT_FAILURE_REASONS = ('login_required', 'not_found', 'unsupported')
+negative_cache = {}
+_negative_cache_lock = threading.Lock()
+
+# Extraction strategy routing: outcomes are tracked over a sliding window and a
+# strategy that keeps failing is skipped until a background probe succeeds
+STRATEGY_WINDOW = int(os.environ.get('STRATEGY_WINDOW', 20))
+STRATEGY_FAILURE_THRESHOLD = int(os.environ.get('STRATEGY_FAILURE_THRESHOLD', 3))
+STRATEGY_COOLDOWN = int(os.environ.get('STRATEGY_COOLDOWN', 300))
+
 # Initialize cloudscraper for Instagram requests
 def get_instagram_session():
     """Create a cloudscraper session with Instagram cookies"""
@@ -63,6 +193,37 @@ def get_instagram_session():
     
     return scraper
 
+def get_upstream_session():
+    """Return the shared pooled HTTP session used for upstream fetches"""
+    global _upstream_session
+    with _upstream_lock:
+        if _upstream_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=UPSTREAM_POOL_SIZE,
+                pool_maxsize=UPSTREAM_POOL_SIZE,
+                max_retries=2
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = (
+                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+            )
+            _upstream_session = session
+        return _upstream_session
+
+def read_limited(response, limit):
+    """Read at most limit bytes of a streamed response body"""
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    return b''.join(chunks)[:limit]
+
 def is_instagram_url(url):
     """Check if URL is from Instagram"""
     return 'instagram.com' in url.lower()
@@ -87,16 +248,88 @@ def sanitize_filename(filename):
     filename = re.sub(r'\s+', ' ', filename).strip()
     return filename[:100]
 
+def canonical_url(url):
+    """Normalise a video URL so equivalent links share cache entries"""
+    url = url.strip()
+    parsed = urlparse(url if '://' in url else f'https://{url}')
+    host = parsed.netloc.lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    
+    if host == 'youtu.be':
+        return f"https://youtube.com/watch?v={parsed.path.strip('/')}"
+    if host.endswith('youtube.com'):
+        video_id = parse_qs(parsed.query).get('v')
+        if video_id:
+            return f"https://youtube.com/watch?v={video_id[0]}"
+    if host.endswith('instagram.com'):
+        post_id = get_instagram_post_id(url)
+        if post_id:
+            return f"https://instagram.com/p/{post_id}/"
+    
+    # Drop fragments and tracking parameters for everything else
+    query = '&'.join(
+        part for part in parsed.query.split('&')
+        if part and not part.startswith(('utm_', 'si=', 'igsh=', 'feature='))
+    )
+    path = parsed.path.rstrip('/') or '/'
+    return f"https://{host}{path}" + (f"?{query}" if query else '')
+
+def classify_failure(error):
+    """Classify an extraction error, returning None for temporary failures.
+
+    Errors raised by a StrategyRouter are classified across every strategy's
+    error, not only the last one tried.
+    """
+    messages = getattr(error, 'errors', None) or [str(error)]
+    for reason, pattern in NEGATIVE_RESULT_PATTERNS:
+        if any(re.search(pattern, message) for message in messages):
+            return reason
+    return None
+
+def cache_failure(url, error, message, status):
+    """Remember a permanent extraction failure for a canonical URL"""
+    reason = classify_failure(error)
+    if not reason:
+        return
+    ttl = NEGATIVE_CACHE_RATE_LIMIT_TTL if reason == 'rate_limited' else NEGATIVE_CACHE_TTL
+    with _negative_cache_lock:
+        if len(negative_cache) >= NEGATIVE_CACHE_SIZE:
+            negative_cache.pop(next(iter(negative_cache)))
+        negative_cache[canonical_url(url)] = {
+            'reason': reason,
+            'error': message,
+            'status': status,
+            'expires': time.time() + ttl,
+        }
+
+def get_cached_failure(url):
+    """Return the cached failure for a URL, if one is still valid"""
+    key = canonical_url(url)
+    with _negative_cache_lock:
+        entry = negative_cache.get(key)
+        if entry and entry['expires'] <= time.time():
+            del negative_cache[key]
+            entry = None
+    return entry
+
+def failure_response(url, error, status):
+    """Build an error response, tagged with the failure reason when known"""
+    body = {'error': error}
+    failure = get_cached_failure(url)
+    if failure:
+        body['reason'] = failure['reason']
+    return jsonify(body), status
+
 def get_video_info(url):
     """Extract video information without downloading"""
     if is_instagram_url(url):
-        # Try cloudscraper first, then fallback to yt-dlp
+        # Try the currently best performing strategy first
         try:
-            return get_instagram_info(url)
+            return instagram_router.run(url)
         except Exception as e:
-            logger.warning(f"Cloudscraper failed for Instagram: {e}")
-            logger.info("Trying yt-dlp as fallback for Instagram...")
-            return get_instagram_info_ytdlp(url)
+            cache_failure(url, e, str(e), 500)
+            raise
     
     # Use yt-dlp for other platforms
     ydl_opts = {
@@ -158,7 +391,74 @@ def get_video_info(url):
             }
     except Exception as e:
         logger.error(f"Error extracting video info: {str(e)}")
+        cache_failure(url, e, 'Could not extract video information', 400)
+        return None
+
+def get_meta_content(content, name):
+    """Return the content of a <meta property/name/itemprop=...> tag"""
+    patterns = [
+        rf'<meta[^>]+(?:property|name|itemprop)="{re.escape(name)}"[^>]+content="([^"]*)"',
+        rf'<meta[^>]+content="([^"]*)"[^>]+(?:property|name|itemprop)="{re.escape(name)}"',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, content)
+        if match:
+            return html.unescape(match.group(1))
+    return None
+
+def parse_duration(value):
+    """Parse seconds or an ISO 8601 duration such as PT1M30S"""
+    if not value:
+        return 0
+    if value.isdigit():
+        return int(value)
+    match = re.fullmatch(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', value)
+    if not match:
+        return 0
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def get_fast_video_info(url):
+    """Get title, thumbnail and duration in one request, without formats"""
+    session = get_upstream_session()
+    host = urlparse(url).netloc.lower()
+    
+    for domain, endpoint in OEMBED_ENDPOINTS.items():
+        if host == domain or host.endswith('.' + domain):
+            try:
+                response = session.get(endpoint, params={'url': url, 'format': 'json'}, timeout=INFO_FAST_TIMEOUT)
+                if response.status_code == 200:
+                    data = response.json()
+                    if data.get('title'):
+                        return {
+                            'title': data['title'],
+                            'duration': int(data.get('duration') or 0),
+                            'thumbnail': data.get('thumbnail_url', ''),
+                        }
+            except Exception as e:
+                logger.warning(f"oEmbed lookup failed for {url}: {e}")
+            break
+    
+    # Fall back to Open Graph tags on the page itself. Only the <head> is
+    # needed, and the URL may just as well point at a multi-GB media file
+    with closing(session.get(url, timeout=INFO_FAST_TIMEOUT, stream=True)) as response:
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code != 200 or not content_type.startswith('text/html'):
+            return None
+        content = read_limited(response, INFO_FAST_MAX_BYTES).decode(
+            response.encoding or 'utf-8', errors='replace'
+        )
+    title = get_meta_content(content, 'og:title')
+    if not title:
         return None
+    duration = (get_meta_content(content, 'og:video:duration')
+                or get_meta_content(content, 'video:duration')
+                or get_meta_content(content, 'duration'))
+    return {
+        'title': title,
+        'duration': parse_duration(duration),
+        'thumbnail': get_meta_content(content, 'og:image') or '',
+    }
 
 def get_instagram_info(url):
     """Get Instagram post information using cloudscraper"""
@@ -282,6 +582,11 @@ def get_instagram_info(url):
                     title = title[:100] + "..."
                 break
         
+        thumbnail = ''
+        match = re.search(r'<meta property="og:image" content="([^"]+)"', content)
+        if match:
+            thumbnail = html.unescape(match.group(1))
+        
         # Create format info
         format_info = {
             'format_id': 'best',
@@ -300,7 +605,7 @@ def get_instagram_info(url):
         return {
             'title': title,
             'duration': 0,
-            'thumbnail': '',
+            'thumbnail': thumbnail,
             'formats': [format_info]
         }
         
@@ -374,19 +679,496 @@ def get_instagram_info_ytdlp(url):
         logger.error(f"yt-dlp fallback failed for Instagram: {str(e)}")
         raise Exception(f"Instagram error: {str(e)}")
 
+class StrategyError(Exception):
+    """Every strategy of a StrategyRouter failed; errors holds each message"""
+
+    def __init__(self, errors, message):
+        super().__init__(errors[-1] if errors else message)
+        self.errors = errors
+
+class StrategyRouter:
+    """Route extraction requests to the best performing strategy.
+
+    Each strategy keeps a sliding window of (success, latency) outcomes.
+    Strategies are tried in order of success rate, then average latency.
+    After STRATEGY_FAILURE_THRESHOLD consecutive failures a strategy's circuit
+    opens and it is skipped; once STRATEGY_COOLDOWN has passed it is probed in
+    the background with the last URL that worked and closed again on success.
+
+    Only failures that point at the strategy itself are counted: a failure is
+    recorded once another strategy has handled the same URL, and errors about
+    the content (private, deleted, unsupported) are never held against it.
+    """
+
+    def __init__(self, name, strategies):
+        self.name = name
+        self.strategies = strategies
+        self.lock = threading.Lock()
+        self.outcomes = {key: deque(maxlen=STRATEGY_WINDOW) for key in strategies}
+        self.consecutive_failures = {key: 0 for key in strategies}
+        self.open_until = {key: 0 for key in strategies}
+        self.probing = set()
+        self.last_good_url = None
+
+    def _score(self, key):
+        outcomes = self.outcomes[key]
+        if not outcomes:
+            # Untried strategies rank ahead of proven ones so each gets tried
+            # once; among themselves they keep their registration order
+            return (1.0, 0.0)
+        success_rate = sum(1 for ok, _ in outcomes if ok) / len(outcomes)
+        latencies = [latency for ok, latency in outcomes if ok]
+        avg_latency = sum(latencies) / len(latencies) if latencies else float('inf')
+        return (success_rate, -avg_latency)
+
+    def ordered(self):
+        """Return strategy names with closed circuits first, best first"""
+        now = time.time()
+        with self.lock:
+            keys = sorted(self.strategies, key=self._score, reverse=True)
+            closed = [key for key in keys if self.open_until[key] <= now]
+            tripped = [key for key in keys if self.open_until[key] > now]
+        # Only fall back to tripped strategies when nothing else is available
+        return closed or tripped
+
+    def record(self, key, ok, latency, url=None):
+        """Record the outcome of one strategy call"""
+        with self.lock:
+            self.outcomes[key].append((ok, latency))
+            if ok:
+                self.consecutive_failures[key] = 0
+                self.open_until[key] = 0
+                if url:
+                    self.last_good_url = url
+                return
+            self.consecutive_failures[key] += 1
+            if self.consecutive_failures[key] >= STRATEGY_FAILURE_THRESHOLD:
+                if self.open_until[key] <= time.time():
+                    logger.warning(f"{self.name}: circuit opened for strategy '{key}'")
+                self.open_until[key] = time.time() + STRATEGY_COOLDOWN
+
+    def call(self, key, url, record_failure=True):
+        """Call a single strategy and record the outcome"""
+        start = time.time()
+        try:
+            result = self.strategies[key](url)
+        except Exception as e:
+            if record_failure and classify_failure(e) not in CONTENT_FAILURE_REASONS:
+                self.record(key, False, time.time() - start)
+            raise
+        self.record(key, True, time.time() - start, url)
+        return result
+
+    def run(self, url):
+        """Try strategies in order until one succeeds"""
+        errors = []
+        failures = []
+        for key in self.ordered():
+            start = time.time()
+            try:
+                result = self.call(key, url, record_failure=False)
+            except Exception as e:
+                logger.warning(f"{self.name}: strategy '{key}' failed: {e}")
+                errors.append(str(e))
+                if classify_failure(e) not in CONTENT_FAILURE_REASONS:
+                    failures.append((key, time.time() - start))
+                continue
+            # Another strategy handled this URL, so the earlier failures were
+            # the strategies' own; when every strategy fails the URL is to blame
+            for failed_key, latency in failures:
+                self.record(failed_key, False, latency)
+            return result
+        raise StrategyError(errors, f"{self.name}: no strategies available")
+
+    def probe_expired(self):
+        """Re-test strategies whose cooldown has expired"""
+        now = time.time()
+        with self.lock:
+            url = self.last_good_url
+            due = [key for key in self.strategies
+                   if self.open_until[key] and self.open_until[key] <= now
+                   and key not in self.probing]
+            self.probing.update(due)
+        for key in due:
+            try:
+                if url:
+                    logger.info(f"{self.name}: probing strategy '{key}'")
+                    self.call(key, url)
+                    logger.info(f"{self.name}: circuit closed for strategy '{key}'")
+            except Exception as e:
+                logger.warning(f"{self.name}: probe of strategy '{key}' failed: {e}")
+                if classify_failure(e) in CONTENT_FAILURE_REASONS:
+                    # The probe URL itself went away; wait for a new one
+                    # instead of probing it again on every tick
+                    with self.lock:
+                        if self.last_good_url == url:
+                            self.last_good_url = None
+                        self.open_until[key] = time.time() + STRATEGY_COOLDOWN
+            finally:
+                with self.lock:
+                    self.probing.discard(key)
+
+    def stats(self):
+        """Summarise the current state of each strategy"""
+        now = time.time()
+        with self.lock:
+            return {
+                key: {
+                    'success_rate': round(self._score(key)[0], 2),
+                    'samples': len(self.outcomes[key]),
+                    'circuit': 'open' if self.open_until[key] > now else 'closed',
+                }
+                for key in self.strategies
+            }
+
+instagram_router = StrategyRouter('instagram', {
+    'cloudscraper': get_instagram_info,
+    'ytdlp': get_instagram_info_ytdlp,
+})
+
+class FragmentTuner:
+    """Pick fragment download concurrency per host.
+
+    Every finished segmented stream reports its throughput and fragment error
+    rate. An error rate above FRAGMENT_ERROR_THRESHOLD halves the host's
+    concurrency; otherwise it grows by one while throughput keeps improving
+    and shrinks by one when it drops. Concurrency handed out to running jobs
+    on the same host never exceeds FRAGMENT_HOST_LIMIT in total; streams wait
+    for a free slot once the limit is reached. A limit of 0 disables the cap.
+
+    Streams that got fewer slots than the host's concurrency because of the
+    cap report throughput scaled up to that concurrency, so contention doesn't
+    drag the learned value down.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots_freed = threading.Condition(self.lock)
+        self.hosts = {}
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {
+                'concurrency': FRAGMENT_START_CONCURRENCY,
+                'throughput': 0.0,
+                'error_rate': 0.0,
+                'active': 0,
+                'samples': 0,
+            }
+        return self.hosts[host]
+
+    def acquire(self, host):
+        """Reserve fragment slots for one stream on a host"""
+        with self.lock:
+            state = self._host(host)
+            if not FRAGMENT_HOST_LIMIT:
+                state['active'] += state['concurrency']
+                return state['concurrency']
+            while state['active'] >= FRAGMENT_HOST_LIMIT:
+                self.slots_freed.wait()
+            slots = min(state['concurrency'], FRAGMENT_HOST_LIMIT - state['active'])
+            state['active'] += slots
+            return slots
+
+    def release(self, host, slots, throughput=None, error_rate=None):
+        """Return fragment slots and adapt the host's concurrency.
+
+        Without a throughput the slots are only returned, e.g. for streams
+        that were cancelled rather than failed by the host.
+        """
+        with self.lock:
+            state = self._host(host)
+            state['active'] = max(0, state['active'] - slots)
+            self.slots_freed.notify_all()
+            if throughput is None:
+                return
+            previous = state['throughput']
+            concurrency = state['concurrency']
+            throughput = throughput * concurrency / max(slots, 1)
+            if error_rate > FRAGMENT_ERROR_THRESHOLD:
+                state['concurrency'] = max(1, concurrency // 2)
+            elif not previous or throughput > previous * 1.1:
+                state['concurrency'] = min(FRAGMENT_MAX_CONCURRENCY, concurrency + 1)
+            elif throughput < previous * 0.9:
+                state['concurrency'] = max(1, concurrency - 1)
+            # Exponentially weighted averages so one odd stream doesn't dominate
+            state['throughput'] = throughput if not previous else 0.7 * previous + 0.3 * throughput
+            state['error_rate'] = 0.7 * state['error_rate'] + 0.3 * error_rate
+            state['samples'] += 1
+
+    def stats(self):
+        """Summarise the tuning state of each host"""
+        with self.lock:
+            return {
+                host: {
+                    'concurrency': state['concurrency'],
+                    'active': state['active'],
+                    'throughput': int(state['throughput']),
+                    'error_rate': round(state['error_rate'], 3),
+                    'samples': state['samples'],
+                }
+                for host, state in self.hosts.items()
+            }
+
+fragment_tuner = FragmentTuner()
+
+class FragmentLogger:
+    """yt-dlp logger that counts fragment retries for a download"""
+
+    def __init__(self, download_id):
+        self.download_id = download_id
+
+    def _count_fragment_error(self, msg):
+        stats = fragment_stats.get(self.download_id)
+        if stats is not None and FRAGMENT_ERROR_PATTERN.search(msg):
+            stats['errors'] += 1
+
+    def debug(self, msg):
+        # Downloaders report fragment retries and skips through to_screen,
+        # which reaches the logger as debug messages
+        self._count_fragment_error(msg)
+        if not msg.startswith('[debug] '):
+            logger.info(msg)
+
+    def info(self, msg):
+        logger.info(msg)
+
+    def warning(self, msg):
+        self._count_fragment_error(msg)
+        logger.warning(msg)
+
+    def error(self, msg):
+        logger.error(msg)
+
+def is_fragmented(stream):
+    """Check whether a format is downloaded as HLS/DASH fragments"""
+    protocol = stream.get('protocol') or ''
+    return bool(stream.get('fragments')) or 'm3u8' in protocol or 'dash' in protocol
+
+def get_postprocess_pool():
+    """Return the shared post-processing process pool, creating it on first use"""
+    global _postprocess_pool
+    with _postprocess_lock:
+        if _postprocess_pool is None:
+            _postprocess_pool = ProcessPoolExecutor(max_workers=POSTPROCESS_WORKERS)
+        return _postprocess_pool
+
+def run_ffmpeg(args):
+    """Run ffmpeg with the given arguments, raising on failure"""
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error'] + args
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+
+def merge_streams(video_path, audio_path, output_path):
+    """Merge separate video and audio streams without re-encoding"""
+    run_ffmpeg([
+        '-i', video_path, '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c', 'copy', output_path
+    ])
+    for path in (video_path, audio_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return output_path
+
+def extract_audio(input_path, output_path, codec):
+    """Extract the audio track of a downloaded file into an audio-only file"""
+    if Path(input_path).resolve() == Path(output_path).resolve():
+        # ffmpeg can't write over the file it is reading
+        return output_path
+    
+    args = ['-i', input_path, '-vn']
+    if codec == 'aac' and input_path.endswith('.m4a'):
+        args += ['-c:a', 'copy']
+    else:
+        args += ['-c:a', codec, '-b:a', '192k']
+    run_ffmpeg(args + [output_path])
+    if os.path.exists(input_path):
+        os.remove(input_path)
+    return output_path
+
+def single_stream_info(info):
+    """Copy an extracted info dict without its merged format selection.
+
+    yt-dlp carries requested_formats into every format it processes, which
+    would send each per-stream pass back into its own inline merge.
+    """
+    stream_info = copy.deepcopy(info)
+    for key in ('requested_formats', 'requested_downloads'):
+        stream_info.pop(key, None)
+    return stream_info
+
+def merged_extension(video_ext, audio_ext):
+    """Pick a container that can hold both streams without re-encoding"""
+    if video_ext == 'mp4' and audio_ext in ('m4a', 'mp4'):
+        return 'mp4'
+    if video_ext == 'webm' and audio_ext == 'webm':
+        return 'webm'
+    return 'mkv'
+
+def create_workspace(download_id):
+    """Create a private temporary directory for one download job"""
+    return Path(tempfile.mkdtemp(prefix=f'{download_id}-', dir=WORK_DIR))
+
+def discard_workspace(workspace):
+    """Remove a job workspace and anything left in it"""
+    if workspace:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+def finalize_download(download_id, source_path, workspace):
+    """Atomically move a finished file into its job-indexed location"""
+    source_path = Path(source_path)
+    if not source_path.is_file():
+        raise Exception("Download completed but file not found")
+    
+    job_dir = DOWNLOADS_DIR / download_id
+    job_dir.mkdir(exist_ok=True)
+    final_path = job_dir / source_path.name
+    os.replace(source_path, final_path)
+    discard_workspace(workspace)
+    
+    download_files[download_id] = str(final_path)
+    download_progress[download_id] = {'status': 'completed', 'progress': 100}
+    return final_path
+
+def submit_postprocess(download_id, workspace, func, *args):
+    """Queue CPU-bound work for a download and finish it when the pool is done"""
+    download_progress[download_id] = {'status': 'queued', 'phase': 'postprocess', 'progress': 0}
+    future = get_postprocess_pool().submit(func, *args)
+    postprocess_jobs[download_id] = future
+    future.add_done_callback(lambda f: finish_postprocess(download_id, workspace, f))
+
+def finish_postprocess(download_id, workspace, future):
+    """Record the result of a post-processing job"""
+    postprocess_jobs.pop(download_id, None)
+    if download_id in cancelled_downloads:
+        discard_workspace(workspace)
+        delete_file(download_id)
+        cancelled_downloads.discard(download_id)
+        return
+    try:
+        finalize_download(download_id, future.result(), workspace)
+    except Exception as e:
+        logger.error(f"Post-processing failed for {download_id}: {str(e)}")
+        discard_workspace(workspace)
+        download_progress[download_id] = {'status': 'error', 'error': str(e)}
+
+def register_thumbnail(thumbnail_url):
+    """Register an origin thumbnail URL and return its proxy key"""
+    key = hashlib.sha256(thumbnail_url.encode()).hexdigest()[:32]
+    with _thumbnail_lock:
+        if len(thumbnail_sources) >= 10000:
+            thumbnail_sources.pop(next(iter(thumbnail_sources)))
+        thumbnail_sources[key] = thumbnail_url
+    return key
+
+def cache_thumbnail_in_memory(key, data):
+    """Store a thumbnail in the memory LRU, evicting the oldest entries"""
+    with _thumbnail_lock:
+        thumbnail_memory_cache[key] = data
+        thumbnail_memory_cache.move_to_end(key)
+        total = sum(len(value) for value in thumbnail_memory_cache.values())
+        while total > THUMBNAIL_MEMORY_CACHE_BYTES and len(thumbnail_memory_cache) > 1:
+            _, evicted = thumbnail_memory_cache.popitem(last=False)
+            total -= len(evicted)
+
+def stat_or_none(path):
+    """Stat a file that may be removed concurrently"""
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        return None
+
+def cache_thumbnail_on_disk(key, data):
+    """Store a thumbnail on disk, evicting least recently used files.
+
+    The cache size is tracked in memory, so the directory is only scanned when
+    the limit is exceeded.
+    """
+    global thumbnail_disk_bytes
+    path = THUMBNAIL_CACHE_DIR / f'{key}-{THUMBNAIL_WIDTH}.jpg'
+    tmp_path = THUMBNAIL_CACHE_DIR / f'.{key}.{uuid.uuid4().hex}.tmp'
+    with _thumbnail_disk_lock:
+        if thumbnail_disk_bytes is None:
+            stats = [stat_or_none(p) for p in THUMBNAIL_CACHE_DIR.glob('*.jpg')]
+            thumbnail_disk_bytes = sum(st.st_size for st in stats if st)
+        
+        previous = stat_or_none(path)
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        thumbnail_disk_bytes += len(data) - (previous.st_size if previous else 0)
+        if thumbnail_disk_bytes <= THUMBNAIL_DISK_CACHE_BYTES:
+            return
+        
+        entries = []
+        for old_path in THUMBNAIL_CACHE_DIR.glob('*.jpg'):
+            st = stat_or_none(old_path)
+            if st and old_path != path:
+                entries.append((st.st_mtime, st.st_size, old_path))
+        thumbnail_disk_bytes = len(data) + sum(size for _, size, _ in entries)
+        for _, size, old_path in sorted(entries):
+            if thumbnail_disk_bytes <= THUMBNAIL_DISK_CACHE_BYTES:
+                break
+            old_path.unlink(missing_ok=True)
+            thumbnail_disk_bytes -= size
+
+def get_thumbnail(key):
+    """Return downscaled JPEG bytes for a thumbnail key, or None if unknown"""
+    with _thumbnail_lock:
+        data = thumbnail_memory_cache.get(key)
+        if data is not None:
+            thumbnail_memory_cache.move_to_end(key)
+            return data
+        source_url = thumbnail_sources.get(key)
+    
+    path = THUMBNAIL_CACHE_DIR / f'{key}-{THUMBNAIL_WIDTH}.jpg'
+    try:
+        data = path.read_bytes()
+        os.utime(path)  # Mark as recently used for the disk LRU
+        cache_thumbnail_in_memory(key, data)
+        return data
+    except FileNotFoundError:
+        pass
+    
+    if not source_url:
+        return None
+    
+    # The source may come from a page's og:image, so its size isn't trusted
+    with closing(get_upstream_session().get(source_url, timeout=10, stream=True)) as response:
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch thumbnail: {response.status_code}")
+        content = read_limited(response, THUMBNAIL_MAX_SOURCE_BYTES + 1)
+    if len(content) > THUMBNAIL_MAX_SOURCE_BYTES:
+        raise Exception("Thumbnail source is too large")
+    
+    image = Image.open(BytesIO(content))
+    image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4))
+    output = BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=80, optimize=True)
+    data = output.getvalue()
+    
+    cache_thumbnail_on_disk(key, data)
+    cache_thumbnail_in_memory(key, data)
+    return data
+
 def download_video_advanced(url, format_type, title, download_id):
     """Download video with advanced options"""
+    if is_instagram_url(url):
+        return download_instagram_video(url, format_type, title, download_id)
+    
+    workspace = None
     try:
-        if is_instagram_url(url):
-            return download_instagram_video(url, format_type, title, download_id)
+        workspace = create_workspace(download_id)
         
         # Sanitize title for filename
         safe_title = sanitize_filename(title)
+        audio_codec = AUDIO_FORMATS.get(format_type)
         
         # Use yt-dlp for other platforms
         ydl_opts = {
-            'format': format_type,
-            'outtmpl': str(DOWNLOADS_DIR / f'{safe_title}.%(ext)s'),
+            'format': 'bestaudio/best' if audio_codec else format_type,
+            'outtmpl': str(workspace / f'{safe_title}.%(ext)s'),
             'progress_hooks': [lambda d: progress_hook(d, download_id)],
             'quiet': False,
             'no_warnings': False,
@@ -396,29 +1178,82 @@ def download_video_advanced(url, format_type, title, download_id):
             ydl_opts['cookiefile'] = 'cookies.txt'
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+            info = ydl.extract_info(url, download=False)
+        
+        # Fetch each selected stream separately; merging is left to the
+        # post-processing pool instead of running inline on this thread
+        streams = info.get('requested_formats') or [info]
+        stream_paths = []
+        for stream in streams:
+            stream_opts = dict(ydl_opts, format=stream['format_id'])
+            if len(streams) > 1:
+                stream_opts['outtmpl'] = str(workspace / f'f{stream["format_id"]}.%(ext)s')
+            
+            if not is_fragmented(stream):
+                with yt_dlp.YoutubeDL(stream_opts) as ydl:
+                    result = ydl.process_ie_result(single_stream_info(info), download=True)
+                stream_paths.append(result['requested_downloads'][0]['filepath'])
+                continue
+            
+            # Segmented streams fetch fragments in parallel, tuned per host
+            host = urlparse(stream.get('url') or stream.get('manifest_url') or url).netloc
+            slots = fragment_tuner.acquire(host)
+            stats = {
+                'host': host,
+                'concurrency': slots,
+                'index': 0,
+                'count': 0,
+                'errors': 0,
+                'bytes': 0,
+                'elapsed': 0,
+            }
+            fragment_stats[download_id] = stats
+            stream_opts['concurrent_fragment_downloads'] = slots
+            stream_opts['logger'] = FragmentLogger(download_id)
+            try:
+                with yt_dlp.YoutubeDL(stream_opts) as ydl:
+                    result = ydl.process_ie_result(single_stream_info(info), download=True)
+            except Exception:
+                if download_id in cancelled_downloads:
+                    # Cancellations and prefetch budget aborts aren't the host's fault
+                    fragment_tuner.release(host, slots)
+                else:
+                    fragment_tuner.release(host, slots, 0, 1.0)
+                raise
+            throughput = stats['bytes'] / stats['elapsed'] if stats['elapsed'] else 0
+            fragment_tuner.release(host, slots, throughput, stats['errors'] / max(stats['count'], 1))
+            stream_paths.append(result['requested_downloads'][0]['filepath'])
         
-        # Find the downloaded file
-        for file_path in DOWNLOADS_DIR.glob(f'{safe_title}.*'):
-            if file_path.is_file():
-                download_files[download_id] = str(file_path)
-                download_progress[download_id] = {'status': 'completed', 'progress': 100}
-                return True
+        if len(stream_paths) > 1:
+            ext = merged_extension(streams[0].get('ext'), streams[1].get('ext'))
+            output_path = str(workspace / f'{safe_title}.{ext}')
+            submit_postprocess(download_id, workspace, merge_streams, stream_paths[0], stream_paths[1], output_path)
+            return True
         
-        raise Exception("Download completed but file not found")
+        # Best audio already in the requested container needs no conversion
+        if audio_codec and Path(stream_paths[0]).suffix != f'.{format_type}':
+            output_path = str(workspace / f'{safe_title}.{format_type}')
+            submit_postprocess(download_id, workspace, extract_audio, stream_paths[0], output_path, audio_codec)
+            return True
+        
+        finalize_download(download_id, stream_paths[0], workspace)
+        return True
         
     except Exception as e:
         logger.error(f"Error in download_video_advanced: {str(e)}")
+        discard_workspace(workspace)
         download_progress[download_id] = {'status': 'error', 'error': str(e)}
         return False
 
 def download_instagram_video(url, format_type, title, download_id):
     """Download Instagram video using cloudscraper"""
+    workspace = None
     try:
         logger.info(f"Downloading Instagram video: {url}")
+        workspace = create_workspace(download_id)
         
         # Get video info first
-        info = get_instagram_info(url)
+        info = instagram_router.run(url)
         if not info or not info.get('formats'):
             raise Exception("Could not get video information")
         
@@ -438,7 +1273,7 @@ def download_instagram_video(url, format_type, title, download_id):
         safe_title = sanitize_filename(title)
         
         # Save the video
-        file_path = DOWNLOADS_DIR / f'{safe_title}.mp4'
+        file_path = workspace / f'{safe_title}.mp4'
         total_size = int(response.headers.get('content-length', 0))
         downloaded = 0
         
@@ -447,6 +1282,7 @@ def download_instagram_video(url, format_type, title, download_id):
                 if chunk:
                     f.write(chunk)
                     downloaded += len(chunk)
+                    check_cancelled(download_id, downloaded)
                     if total_size > 0:
                         progress = int((downloaded / total_size) * 100)
                         download_progress[download_id] = {
@@ -456,17 +1292,40 @@ def download_instagram_video(url, format_type, title, download_id):
                             'total': total_size
                         }
         
-        download_files[download_id] = str(file_path)
-        download_progress[download_id] = {'status': 'completed', 'progress': 100}
+        codec = AUDIO_FORMATS.get(format_type)
+        if codec:
+            output_path = str(workspace / f'{safe_title}.{format_type}')
+            submit_postprocess(download_id, workspace, extract_audio, str(file_path), output_path, codec)
+            return True
+        
+        finalize_download(download_id, file_path, workspace)
         return True
         
     except Exception as e:
         logger.error(f"Error downloading Instagram video: {str(e)}")
+        discard_workspace(workspace)
         download_progress[download_id] = {'status': 'error', 'error': str(e)}
         return False
 
+def check_cancelled(download_id, downloaded=0):
+    """Abort a download that was cancelled or outgrew its prefetch reservation"""
+    if download_id in cancelled_downloads:
+        raise Exception("Download cancelled")
+    reserved = prefetch_reservations.get(download_id)
+    if reserved and downloaded > reserved:
+        cancelled_downloads.add(download_id)
+        raise Exception("Prefetch exceeded its byte budget")
+
 def progress_hook(d, download_id):
     """Progress hook for yt-dlp downloads"""
+    check_cancelled(download_id, d.get('downloaded_bytes') or 0)
+    stats = fragment_stats.get(download_id)
+    if stats is not None:
+        stats['index'] = d.get('fragment_index') or stats['index']
+        stats['count'] = d.get('fragment_count') or stats['count']
+        stats['bytes'] = d.get('downloaded_bytes') or stats['bytes']
+        stats['elapsed'] = d.get('elapsed') or stats['elapsed']
+    
     if d['status'] == 'downloading':
         if 'total_bytes' in d and d['total_bytes']:
             progress = int((d['downloaded_bytes'] / d['total_bytes']) * 100)
@@ -477,29 +1336,447 @@ def progress_hook(d, download_id):
         
         download_progress[download_id] = {
             'status': 'downloading',
+            'phase': 'download',
             'progress': progress,
             'downloaded': d.get('downloaded_bytes', 0),
             'total': d.get('total_bytes', 0)
         }
+        if stats is not None:
+            download_progress[download_id]['fragments'] = {
+                key: stats[key] for key in ('index', 'count', 'concurrency', 'errors')
+            }
     elif d['status'] == 'finished':
-        download_progress[download_id] = {'status': 'completed', 'progress': 100}
+        # Completion is reported by the caller once the file is final, since
+        # merges and audio extraction still have to run after this
+        download_progress[download_id] = {'status': 'downloading', 'phase': 'download', 'progress': 100}
+
+def estimate_download_size(info, format_type):
+    """Estimate the bytes a download will transfer from /api/info data"""
+    formats = info.get('formats') or []
+    for fmt in formats:
+        if fmt.get('format_id') == format_type and fmt.get('filesize'):
+            return fmt['filesize']
+    sizes = [fmt.get('filesize') or 0 for fmt in formats if fmt.get('has_audio')]
+    return max(sizes) if sizes else 0
+
+def admission_job_bytes(filesize):
+    """Turn a client-reported filesize into the bytes admission control reserves.
+
+    The client's value can only raise the estimate: missing, invalid and small
+    sizes all count as ADMISSION_DEFAULT_JOB_BYTES.
+    """
+    try:
+        size = int(filesize or 0)
+    except (TypeError, ValueError, OverflowError):
+        size = 0
+    return max(size, ADMISSION_DEFAULT_JOB_BYTES)
+
+def expire_prefetches(force=False):
+    """Cancel and evict unclaimed prefetches that are past their TTL"""
+    now = time.time()
+    with _prefetch_lock:
+        expired = [key for key, job in prefetch_jobs.items()
+                   if force or now - job['started'] > PREFETCH_TTL]
+        jobs = [prefetch_jobs.pop(key) for key in expired]
+    for job in jobs:
+        evict_prefetch(job)
+
+def evict_prefetch(job):
+    """Cancel a running prefetch or delete the file of a finished one"""
+    download_id = job['download_id']
+    prefetch_reservations.pop(download_id, None)
+    status = download_progress.get(download_id, {}).get('status')
+    if status in ('completed', 'error', None):
+        delete_file(download_id)
+    else:
+        # The prefetch thread cleans up once the download notices
+        cancelled_downloads.add(download_id)
+
+def shed_prefetches(needed_bytes=0):
+    """Cancel unclaimed prefetches, oldest first, until enough bytes are free"""
+    with _prefetch_lock:
+        jobs = sorted(prefetch_jobs.items(), key=lambda item: item[1]['started'])
+        freed = 0
+        victims = []
+        for key, job in jobs:
+            if needed_bytes and freed >= needed_bytes:
+                break
+            victims.append(prefetch_jobs.pop(key))
+            freed += job['reserved']
+    for job in victims:
+        evict_prefetch(job)
+    return freed
+
+def start_prefetch(url, info):
+    """Start a low-priority background download of the most likely format"""
+    # Prefetches run in-process, so they are only used without external workers
+    if not PREFETCH_ENABLED or get_job_queue() is not None:
+        return None
+    
+    expire_prefetches()
+    key = (canonical_url(url), PREFETCH_FORMAT)
+    reserved = estimate_download_size(info, PREFETCH_FORMAT) or PREFETCH_MAX_FILE_BYTES
+    if reserved > PREFETCH_MAX_FILE_BYTES:
+        return None
+    
+    with _prefetch_lock:
+        if key in prefetch_jobs:
+            return None
+        running = [job for job in prefetch_jobs.values()
+                   if download_progress.get(job['download_id'], {}).get('status') not in ('completed', 'error')]
+        in_use = sum(job['reserved'] for job in prefetch_jobs.values())
+        if len(running) >= PREFETCH_MAX_CONCURRENT or in_use + reserved > PREFETCH_MAX_BYTES:
+            return None
+        
+        download_id = str(uuid.uuid4())
+        prefetch_jobs[key] = {
+            'download_id': download_id,
+            'reserved': reserved,
+            'started': time.time(),
+        }
+        prefetch_reservations[download_id] = reserved
+        download_progress[download_id] = {'status': 'starting', 'progress': 0}
+    
+    def prefetch_thread():
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICE)
+        except (AttributeError, OSError):
+            pass
+        download_video_advanced(url, PREFETCH_FORMAT, info.get('title', 'video'), download_id)
+        if download_id in cancelled_downloads:
+            logger.info(f"Prefetch {download_id} cancelled")
+            delete_file(download_id)
+            cancelled_downloads.discard(download_id)
+    
+    logger.info(f"Prefetching {PREFETCH_FORMAT} for: {url}")
+    threading.Thread(target=prefetch_thread, daemon=True).start()
+    return download_id
+
+def claim_prefetch(url, format_type):
+    """Hand an unclaimed prefetch for this URL and format over to a user download"""
+    with _prefetch_lock:
+        job = prefetch_jobs.pop((canonical_url(url), format_type), None)
+    if not job:
+        return None
+    
+    download_id = job['download_id']
+    prefetch_reservations.pop(download_id, None)
+    if download_id in cancelled_downloads or download_progress.get(download_id, {}).get('status') == 'error':
+        return None
+    logger.info(f"Attached download to prefetch {download_id}")
+    return download_id
+
+class SQLiteJobQueue:
+    """Job queue kept in a SQLite file shared by the API and its workers"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL, '
+                'progress TEXT, file TEXT, worker TEXT, '
+                'created REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, job_id, payload):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, payload, state, created, updated) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, json.dumps(payload), now, now)
+            )
+
+    def claim(self, worker_id):
+        """Atomically take the oldest queued job, or one whose worker went silent"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT id, payload FROM jobs WHERE state = 'queued' "
+                    "OR (state = 'running' AND updated < ?) ORDER BY created LIMIT 1",
+                    (now - JOB_LEASE,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET state = 'running', worker = ?, updated = ? WHERE id = ?",
+                        (worker_id, now, row['id'])
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return dict(json.loads(row['payload']), id=row['id'])
+
+    def update(self, job_id, worker_id, progress, file_path=None, done=False):
+        """Publish a job's progress; returns False once another worker took it over"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET state = ?, progress = ?, file = ?, updated = ? WHERE id = ? AND worker = ?',
+                ('done' if done else 'running', json.dumps(progress), file_path, time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT state, progress, file FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'state': row['state'],
+            'progress': json.loads(row['progress']) if row['progress'] else None,
+            'file': row['file'],
+        }
+
+    def delete(self, job_id):
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def depth(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def purge(self):
+        """Drop finished jobs nobody collected"""
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE state = 'done' AND updated < ?", (time.time() - JOB_RETENTION,))
+
+class RedisJobQueue:
+    """Job queue kept in a Redis-compatible server shared across nodes"""
+
+    # Pop a job and take its lease in one step, so a job that waited longer
+    # than JOB_LEASE is never seen as stale between the two
+    CLAIM_SCRIPT = """
+    local job_id = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+    if not job_id then
+        return false
+    end
+    local key = ARGV[3] .. job_id
+    local payload = redis.call('HGET', key, 'payload')
+    if not payload then
+        redis.call('LREM', KEYS[2], 1, job_id)
+        return false
+    end
+    redis.call('HSET', key, 'state', 'running', 'worker', ARGV[1], 'updated', ARGV[2])
+    return {job_id, payload}
+    """
+
+    # Only the worker holding the lease may publish progress
+    UPDATE_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'worker') ~= ARGV[1] then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'state', ARGV[2], 'progress', ARGV[3], 'file', ARGV[4], 'updated', ARGV[5])
+    if ARGV[2] == 'done' then
+        redis.call('LREM', KEYS[2], 1, ARGV[6])
+        redis.call('EXPIRE', KEYS[1], ARGV[7])
+    end
+    return 1
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise Exception("JOB_QUEUE_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.queued_key = 'jobs:queued'
+        self.running_key = 'jobs:running'
+        self.claim_script = self.client.register_script(self.CLAIM_SCRIPT)
+        self.update_script = self.client.register_script(self.UPDATE_SCRIPT)
+
+    def _key(self, job_id):
+        return f'job:{job_id}'
+
+    def enqueue(self, job_id, payload):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(job_id), mapping={
+            'payload': json.dumps(payload),
+            'state': 'queued',
+            'created': now,
+            'updated': now,
+        })
+        pipe.lpush(self.queued_key, job_id)
+        pipe.execute()
+
+    def _requeue_stale(self):
+        """Put jobs whose worker stopped sending heartbeats back on the queue"""
+        cutoff = time.time() - JOB_LEASE
+        for job_id in self.client.lrange(self.running_key, 0, -1):
+            updated = self.client.hget(self._key(job_id), 'updated')
+            if updated is None or float(updated) < cutoff:
+                # Only the caller that removes the entry requeues it, and the
+                # silent worker loses its lease right away
+                if self.client.lrem(self.running_key, 1, job_id) and updated is not None:
+                    pipe = self.client.pipeline()
+                    pipe.hset(self._key(job_id), mapping={'state': 'queued', 'worker': ''})
+                    pipe.rpush(self.queued_key, job_id)
+                    pipe.execute()
+
+    def claim(self, worker_id):
+        """Atomically move the oldest queued job onto the running list"""
+        self._requeue_stale()
+        claimed = self.claim_script(
+            keys=[self.queued_key, self.running_key],
+            args=[worker_id, time.time(), self._key('')]
+        )
+        if not claimed:
+            return None
+        job_id, payload = claimed
+        return dict(json.loads(payload), id=job_id)
+
+    def update(self, job_id, worker_id, progress, file_path=None, done=False):
+        """Publish a job's progress; returns False once another worker took it over"""
+        return bool(self.update_script(
+            keys=[self._key(job_id), self.running_key],
+            args=[worker_id, 'done' if done else 'running', json.dumps(progress),
+                  file_path or '', time.time(), job_id, JOB_RETENTION]
+        ))
+
+    def get(self, job_id):
+        data = self.client.hgetall(self._key(job_id))
+        if not data:
+            return None
+        return {
+            'state': data.get('state'),
+            'progress': json.loads(data['progress']) if data.get('progress') else None,
+            'file': data.get('file') or None,
+        }
+
+    def delete(self, job_id):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(job_id))
+        pipe.lrem(self.queued_key, 1, job_id)
+        pipe.lrem(self.running_key, 1, job_id)
+        pipe.execute()
+
+    def depth(self):
+        return self.client.llen(self.queued_key)
+
+    def purge(self):
+        """Finished jobs expire on their own in Redis"""
+
+def get_job_queue():
+    """Return the shared job queue, or None when downloads run in-process"""
+    global _job_queue
+    if JOB_QUEUE_BACKEND == 'local':
+        return None
+    with _job_queue_lock:
+        if _job_queue is None:
+            if JOB_QUEUE_BACKEND == 'sqlite':
+                _job_queue = SQLiteJobQueue(JOB_QUEUE_PATH)
+            elif JOB_QUEUE_BACKEND == 'redis':
+                _job_queue = RedisJobQueue(JOB_QUEUE_URL)
+            else:
+                raise Exception(f"Unknown JOB_QUEUE_BACKEND: {JOB_QUEUE_BACKEND}")
+        return _job_queue
+
+def get_download_status(download_id):
+    """Return the progress of a download from this process or the job queue"""
+    if download_id in download_progress:
+        return download_progress[download_id]
+    job_queue = get_job_queue()
+    job = job_queue.get(download_id) if job_queue else None
+    if job is None:
+        return None
+    return job['progress'] or {'status': 'queued', 'phase': 'queue', 'progress': 0}
+
+def get_download_file(download_id):
+    """Return the finished file path of a download, if there is one"""
+    if download_id in download_files:
+        return download_files[download_id]
+    job_queue = get_job_queue()
+    job = job_queue.get(download_id) if job_queue else None
+    return job['file'] if job else None
+
+def get_process_rss():
+    """Return the resident memory of this process in bytes, if known"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def prune_admitted_jobs():
+    """Forget finished jobs and learn how long jobs take on average"""
+    global average_job_seconds
+    now = time.time()
+    for download_id, (_, admitted_at) in list(admitted_jobs.items()):
+        status = (get_download_status(download_id) or {}).get('status')
+        if status in (None, 'completed', 'error'):
+            del admitted_jobs[download_id]
+            if status == 'completed':
+                average_job_seconds = 0.8 * average_job_seconds + 0.2 * (now - admitted_at)
+
+def check_admission(estimated_bytes):
+    """Return (status, reason, retry_after) when a new job must be refused"""
+    prune_admitted_jobs()
+    job_queue = get_job_queue()
+    active = max(len(admitted_jobs), job_queue.depth() if job_queue else 0)
+    # Unclaimed prefetches hold disk and bandwidth too, so they count here
+    inflight = (sum(size for size, _ in admitted_jobs.values())
+                + sum(prefetch_reservations.values()))
+    
+    def retry_after(factor=1.0):
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER, math.ceil(average_job_seconds * factor)))
+    
+    if ADMISSION_MAX_JOBS and active >= ADMISSION_MAX_JOBS:
+        # Roughly how long until enough running jobs have drained
+        return 429, 'queue_full', retry_after((active - ADMISSION_MAX_JOBS + 1) / ADMISSION_MAX_JOBS)
+    
+    # Unclaimed prefetches give way before real downloads are refused
+    if ADMISSION_MAX_INFLIGHT_BYTES and inflight + estimated_bytes > ADMISSION_MAX_INFLIGHT_BYTES:
+        inflight -= shed_prefetches(inflight + estimated_bytes - ADMISSION_MAX_INFLIGHT_BYTES)
+        if inflight + estimated_bytes > ADMISSION_MAX_INFLIGHT_BYTES:
+            return 503, 'bytes_in_flight', retry_after()
+    
+    if ADMISSION_MIN_FREE_DISK_BYTES:
+        free = shutil.disk_usage(DOWNLOADS_DIR).free - inflight
+        if free - estimated_bytes < ADMISSION_MIN_FREE_DISK_BYTES:
+            inflight -= shed_prefetches()
+            free = shutil.disk_usage(DOWNLOADS_DIR).free - inflight
+            if free - estimated_bytes < ADMISSION_MIN_FREE_DISK_BYTES:
+                return 503, 'disk_space', retry_after()
+    
+    rss = get_process_rss()
+    if ADMISSION_MAX_RSS_BYTES and rss is not None and rss > ADMISSION_MAX_RSS_BYTES:
+        return 503, 'memory', retry_after()
+    
+    return None
 
 def delete_file(download_id):
     """Delete downloaded file after serving"""
     try:
-        if download_id in download_files:
-            file_path = Path(download_files[download_id])
+        file_path = get_download_file(download_id)
+        if file_path:
+            file_path = Path(file_path)
             if file_path.exists():
                 file_path.unlink()
-            del download_files[download_id]
-        if download_id in download_progress:
-            del download_progress[download_id]
+            if file_path.parent != DOWNLOADS_DIR:
+                shutil.rmtree(file_path.parent, ignore_errors=True)
+        download_files.pop(download_id, None)
+        download_progress.pop(download_id, None)
+        fragment_stats.pop(download_id, None)
+        job_queue = get_job_queue()
+        if job_queue:
+            job_queue.delete(download_id)
     except Exception as e:
         logger.error(f"Error deleting file {download_id}: {e}")
 
 @app.route('/api/info', methods=['POST'])
 def get_info():
     """Get video information"""
+    url = None
     try:
         data = request.get_json()
         if not data or 'url' not in data:
@@ -508,14 +1785,93 @@ def get_info():
         url = data['url']
         logger.info(f"Analyzing URL: {url}")
         
+        failure = get_cached_failure(url)
+        if failure:
+            logger.info(f"Negative cache hit ({failure['reason']}) for: {url}")
+            return failure_response(url, failure['error'], failure['status'])
+        
+        # Progressive mode: answer with basic metadata now, formats later
+        if data.get('progressive') and not is_instagram_url(url):
+            try:
+                basic = get_fast_video_info(url)
+            except Exception as e:
+                logger.warning(f"Fast info lookup failed for {url}: {e}")
+                basic = None
+            if basic:
+                if basic.get('thumbnail'):
+                    basic['thumbnail_key'] = register_thumbnail(basic['thumbnail'])
+                basic['info_id'] = start_info_job(url)
+                basic['formats_pending'] = True
+                return jsonify(basic)
+        
         info = get_video_info(url)
         if info:
+            complete_info(url, info)
             return jsonify(info)
         else:
-            return jsonify({'error': 'Could not extract video information'}), 400
+            return failure_response(url, 'Could not extract video information', 400)
             
     except Exception as e:
         logger.error(f"Error in get_info: {str(e)}")
+        if url:
+            return failure_response(url, str(e), 500)
+        return jsonify({'error': str(e)}), 500
+
+def complete_info(url, info):
+    """Attach the thumbnail proxy key and kick off any prefetch"""
+    if info.get('thumbnail'):
+        info['thumbnail_key'] = register_thumbnail(info['thumbnail'])
+    start_prefetch(url, info)
+
+def start_info_job(url):
+    """Extract the full format list in the background and return its id"""
+    now = time.time()
+    info_id = str(uuid.uuid4())
+    with _info_jobs_lock:
+        for key in [key for key, job in info_jobs.items() if now - job['created'] > INFO_JOB_TTL]:
+            del info_jobs[key]
+        info_jobs[info_id] = {'status': 'pending', 'created': now}
+    
+    def info_thread():
+        # Same status codes as the blocking /api/info path
+        error, status = 'Could not extract video information', 400
+        try:
+            info = get_video_info(url)
+            if info:
+                complete_info(url, info)
+                info_jobs[info_id] = {'status': 'done', 'info': info, 'created': now}
+                return
+        except Exception as e:
+            error, status = str(e), 500
+        failure = get_cached_failure(url)
+        info_jobs[info_id] = {
+            'status': 'error',
+            'error': failure['error'] if failure else error,
+            'reason': failure['reason'] if failure else None,
+            'http_status': failure['status'] if failure else status,
+            'created': now,
+        }
+    
+    threading.Thread(target=info_thread, daemon=True).start()
+    return info_id
+
+@app.route('/api/info/<info_id>', methods=['GET'])
+def get_info_result(info_id):
+    """Get the full video information for a progressive /api/info request"""
+    try:
+        job = info_jobs.get(info_id)
+        if job is None:
+            return jsonify({'error': 'Info request not found'}), 404
+        if job['status'] == 'pending':
+            return jsonify({'status': 'pending'})
+        if job['status'] == 'error':
+            body = {'error': job['error']}
+            if job['reason']:
+                body['reason'] = job['reason']
+            return jsonify(body), job['http_status']
+        return jsonify(job['info'])
+    except Exception as e:
+        logger.error(f"Error in get_info_result: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/download', methods=['POST'])
@@ -530,8 +1886,47 @@ def download():
         format_type = data.get('format', 'best')
         title = data.get('title', 'video')
         
-        download_id = str(uuid.uuid4())
-        download_progress[download_id] = {'status': 'starting', 'progress': 0}
+        failure = get_cached_failure(url)
+        if failure:
+            return failure_response(url, failure['error'], failure['status'])
+        
+        prefetched_id = claim_prefetch(url, format_type)
+        if prefetched_id:
+            return jsonify({
+                'download_id': prefetched_id,
+                'status': 'started',
+                'prefetched': True
+            })
+        
+        estimated_bytes = admission_job_bytes(data.get('filesize'))
+        with _admission_lock:
+            refusal = check_admission(estimated_bytes)
+            if refusal:
+                status, reason, retry_after = refusal
+                logger.warning(f"Refusing download ({reason}), retry after {retry_after}s")
+                response = jsonify({
+                    'error': 'Server is busy, please retry shortly',
+                    'reason': reason,
+                    'retry_after': retry_after
+                })
+                response.headers['Retry-After'] = str(retry_after)
+                return response, status
+            
+            download_id = str(uuid.uuid4())
+            admitted_jobs[download_id] = (estimated_bytes, time.time())
+            
+            # With external workers the API only enqueues the job
+            job_queue = get_job_queue()
+            if job_queue:
+                job_queue.enqueue(download_id, {'url': url, 'format': format_type, 'title': title})
+            else:
+                download_progress[download_id] = {'status': 'starting', 'progress': 0}
+        
+        if job_queue:
+            return jsonify({
+                'download_id': download_id,
+                'status': 'queued'
+            })
         
         def download_thread():
             download_video_advanced(url, format_type, title, download_id)
@@ -552,8 +1947,13 @@ def download():
 def get_progress(download_id):
     """Get download progress"""
     try:
-        if download_id in download_progress:
-            return jsonify(download_progress[download_id])
+        future = postprocess_jobs.get(download_id)
+        if future is not None and future.running():
+            download_progress[download_id] = {'status': 'processing', 'phase': 'postprocess', 'progress': 0}
+        
+        status = get_download_status(download_id)
+        if status is not None:
+            return jsonify(status)
         else:
             return jsonify({'error': 'Download not found'}), 404
     except Exception as e:
@@ -564,10 +1964,11 @@ def get_progress(download_id):
 def serve_file(download_id):
     """Serve downloaded file"""
     try:
-        if download_id not in download_files:
+        file_path = get_download_file(download_id)
+        if not file_path:
             return jsonify({'error': 'File not found'}), 404
         
-        file_path = Path(download_files[download_id])
+        file_path = Path(file_path)
         if not file_path.exists():
             return jsonify({'error': 'File not found'}), 404
         
@@ -584,20 +1985,68 @@ def serve_file(download_id):
         logger.error(f"Error in serve_file: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/thumbnail/<key>', methods=['GET'])
+def serve_thumbnail(key):
+    """Serve a cached, downscaled thumbnail"""
+    try:
+        if not re.fullmatch(r'[0-9a-f]{32}', key):
+            return jsonify({'error': 'Thumbnail not found'}), 404
+        
+        etag = f'"{key}-{THUMBNAIL_WIDTH}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'public, max-age=86400, immutable'
+        }
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers=headers)
+        
+        data = get_thumbnail(key)
+        if data is None:
+            return jsonify({'error': 'Thumbnail not found'}), 404
+        
+        return Response(data, mimetype='image/jpeg', headers=headers)
+        
+    except Exception as e:
+        logger.error(f"Error in serve_thumbnail: {str(e)}")
+        return jsonify({'error': str(e)}), 502
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    job_queue = get_job_queue()
+    return jsonify({
+        'status': 'healthy',
+        'job_queue': JOB_QUEUE_BACKEND,
+        'queued_jobs': job_queue.depth() if job_queue else 0,
+        'postprocess_queue': len(postprocess_jobs),
+        'postprocess_workers': POSTPROCESS_WORKERS,
+        'instagram_strategies': instagram_router.stats(),
+        'fragment_hosts': fragment_tuner.stats(),
+        'admitted_jobs': len(admitted_jobs)
+    })
 
 def cleanup_old_files():
     """Clean up old downloaded files"""
     try:
         current_time = datetime.now()
-        for file_path in DOWNLOADS_DIR.glob('*'):
-            if file_path.is_file():
-                file_age = current_time - datetime.fromtimestamp(file_path.stat().st_mtime)
-                if file_age > timedelta(hours=1):  # Delete files older than 1 hour
-                    file_path.unlink()
+        for file_path in list(DOWNLOADS_DIR.glob('*')) + list(WORK_DIR.glob('*')):
+            if file_path == WORK_DIR:
+                continue
+            # Leave workspaces of jobs that are still running alone
+            job_id = file_path.name[:36]
+            status = get_download_status(job_id) or {}
+            if status.get('status') not in (None, 'completed', 'error'):
+                continue
+            file_age = current_time - datetime.fromtimestamp(file_path.stat().st_mtime)
+            if file_age > timedelta(hours=1):  # Delete files older than 1 hour
+                if file_path.is_dir():
+                    shutil.rmtree(file_path, ignore_errors=True)
+                else:
+                    file_path.unlink(missing_ok=True)
+        
+        job_queue = get_job_queue()
+        if job_queue:
+            job_queue.purge()
     except Exception as e:
         logger.error(f"Error in cleanup: {e}")
 
@@ -607,8 +2056,18 @@ if __name__ == '__main__':
         while True:
             time.sleep(300)  # Run every 5 minutes
             cleanup_old_files()
+            expire_prefetches()
     
     cleanup_thread_instance = threading.Thread(target=cleanup_thread, daemon=True)
     cleanup_thread_instance.start()
     
+    # Start strategy probe thread
+    def probe_thread():
+        while True:
+            time.sleep(30)
+            instagram_router.probe_expired()
+    
+    probe_thread_instance = threading.Thread(target=probe_thread, daemon=True)
+    probe_thread_instance.start()
+    
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000))) 
@@ -0,0 +1,215 @@
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('yt_dlp')
+pytest.importorskip('cloudscraper')
+pytest.importorskip('PIL')
+
+import app
+
+VIDEO = {'format_id': 'v', 'ext': 'mp4', 'url': 'http://example.com/v.mp4', 'protocol': 'https'}
+AUDIO = {'format_id': 'a', 'ext': 'm4a', 'url': 'http://example.com/a.m4a', 'protocol': 'https'}
+
+class FakeYoutubeDL:
+    """Stands in for yt-dlp: records what each per-stream pass receives"""
+    info = None
+    calls = []
+
+    def __init__(self, params):
+        self.params = params
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        return dict(FakeYoutubeDL.info)
+
+    def process_ie_result(self, info, download=True):
+        FakeYoutubeDL.calls.append((self.params['format'], info))
+        fmt = next(f for f in info['formats'] if f['format_id'] == self.params['format'])
+        path = self.params['outtmpl'].replace('%(ext)s', fmt['ext'])
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        return dict(info, requested_downloads=[{'filepath': path}])
+
+@pytest.fixture
+def fake_ytdlp(monkeypatch, tmp_path):
+    downloads = tmp_path / 'downloads'
+    work = downloads / '.work'
+    work.mkdir(parents=True)
+    monkeypatch.setattr(app, 'DOWNLOADS_DIR', downloads)
+    monkeypatch.setattr(app, 'WORK_DIR', work)
+    monkeypatch.setattr(app.yt_dlp, 'YoutubeDL', FakeYoutubeDL)
+    FakeYoutubeDL.calls = []
+
+    submitted = []
+    monkeypatch.setattr(app, 'submit_postprocess', lambda *args: submitted.append(args))
+    return submitted
+
+def test_two_format_selection_downloads_each_stream_once(fake_ytdlp):
+    FakeYoutubeDL.info = {
+        'id': 'x',
+        'title': 'Video',
+        'format_id': 'v+a',
+        'formats': [VIDEO, AUDIO],
+        'requested_formats': [VIDEO, AUDIO],
+    }
+
+    assert app.download_video_advanced('https://example.com/watch', 'v+a', 'Video', 'job-1')
+
+    assert [fmt for fmt, _ in FakeYoutubeDL.calls] == ['v', 'a']
+    for _, info in FakeYoutubeDL.calls:
+        assert 'requested_formats' not in info
+        assert 'requested_downloads' not in info
+
+    # The merge is left to the post-processing pool
+    (download_id, _, func, video_path, audio_path, output_path), = fake_ytdlp
+    assert download_id == 'job-1'
+    assert func is app.merge_streams
+    assert video_path.endswith('fv.mp4') and audio_path.endswith('fa.m4a')
+    assert output_path.endswith('Video.mp4')
+
+def test_audio_in_requested_container_skips_extraction(fake_ytdlp):
+    FakeYoutubeDL.info = dict(AUDIO, id='x', title='Song', formats=[AUDIO])
+
+    assert app.download_video_advanced('https://example.com/watch', 'm4a', 'Song', 'job-2')
+
+    assert fake_ytdlp == []
+    assert app.download_progress['job-2']['status'] == 'completed'
+    assert app.download_files['job-2'].endswith('Song.m4a')
+
+def test_shed_prefetch_does_not_admit_past_inflight_limit(monkeypatch):
+    gib = 1024 * 1024 * 1024
+    monkeypatch.setattr(app, 'ADMISSION_MAX_INFLIGHT_BYTES', 4 * gib)
+    monkeypatch.setattr(app, 'ADMISSION_MIN_FREE_DISK_BYTES', 0)
+    monkeypatch.setattr(app, 'admitted_jobs', {'running': (4 * gib, 0)})
+    monkeypatch.setattr(app, 'prune_admitted_jobs', lambda: None)
+    monkeypatch.setattr(app, 'prefetch_jobs', {
+        ('https://example.com/p', 'best'): {'download_id': 'prefetch', 'reserved': 200 * 1024 * 1024, 'started': 0},
+    })
+    monkeypatch.setattr(app, 'prefetch_reservations', {'prefetch': 200 * 1024 * 1024})
+    monkeypatch.setattr(app, 'evict_prefetch', lambda job: app.prefetch_reservations.pop(job['download_id'], None))
+
+    status, reason, _ = app.check_admission(100 * 1024 * 1024)
+
+    assert (status, reason) == (503, 'bytes_in_flight')
+    assert app.prefetch_jobs == {}
+
+def test_router_failure_is_classified_across_all_strategies():
+    error = app.StrategyError(['Failed to fetch Instagram post: 429', 'Connection reset by peer'], '')
+
+    assert str(error) == 'Connection reset by peer'
+    assert app.classify_failure(error) == 'rate_limited'
+
+def failing(message):
+    def strategy(url):
+        raise Exception(message)
+    return strategy
+
+def test_router_only_counts_failures_another_strategy_recovered_from():
+    router = app.StrategyRouter('test', {
+        'broken': failing('Connection reset by peer'),
+        'working': lambda url: {'title': 'Video'},
+    })
+
+    assert router.run('https://example.com/p/1') == {'title': 'Video'}
+    assert router.consecutive_failures == {'broken': 1, 'working': 0}
+
+def test_router_does_not_count_content_failures():
+    router = app.StrategyRouter('test', {
+        'first': failing('Failed to fetch Instagram post: 404'),
+        'second': failing('Connection reset by peer'),
+    })
+
+    with pytest.raises(app.StrategyError):
+        router.run('https://example.com/p/deleted')
+    assert router.consecutive_failures == {'first': 0, 'second': 0}
+    assert all(not outcomes for outcomes in router.outcomes.values())
+
+class FakeResponse:
+    def __init__(self, content_type, body):
+        self.status_code = 200
+        self.headers = {'Content-Type': content_type}
+        self.encoding = 'utf-8'
+        self.body = body
+        self.read = 0
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.read += chunk_size
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+def test_fast_info_skips_media_and_reads_only_the_page_head(monkeypatch):
+    page = b'<head><meta property="og:title" content="Video"></head>' + b' ' * (4 * 1024 * 1024)
+    responses = {
+        'https://example.com/clip.mp4': FakeResponse('video/mp4', b'\0' * 1024),
+        'https://example.com/watch': FakeResponse('text/html; charset=utf-8', page),
+    }
+    session = type('Session', (), {'get': lambda self, url, **kwargs: responses[url]})()
+    monkeypatch.setattr(app, 'get_upstream_session', lambda: session)
+
+    assert app.get_fast_video_info('https://example.com/clip.mp4') is None
+    assert responses['https://example.com/clip.mp4'].read == 0
+    assert app.get_fast_video_info('https://example.com/watch')['title'] == 'Video'
+    assert responses['https://example.com/watch'].read <= app.INFO_FAST_MAX_BYTES
+
+@pytest.mark.parametrize('filesize', [None, '', 'abc', -10 ** 13, 0, 1024, float('inf')])
+def test_client_filesize_cannot_lower_the_admission_estimate(filesize):
+    assert app.admission_job_bytes(filesize) == app.ADMISSION_DEFAULT_JOB_BYTES
+
+def test_client_filesize_raises_the_admission_estimate():
+    size = app.ADMISSION_DEFAULT_JOB_BYTES * 3
+    assert app.admission_job_bytes(str(size)) == size
+
+@pytest.mark.parametrize('message, reason', [
+    ('Unable to log in: connection reset', None),
+    ("ERROR: [youtube] abc: Sign in to confirm you’re not a bot", 'rate_limited'),
+    ('ERROR: [youtube] abc: Sign in to confirm your age', 'login_required'),
+    ('ERROR: [youtube] abc: Private video', 'login_required'),
+    ('ERROR: [instagram] abc: You need to log in to access this content', 'login_required'),
+])
+def test_classify_failure_only_caches_real_login_walls(message, reason):
+    assert app.classify_failure(Exception(message)) == reason
+
+def test_probe_of_deleted_url_waits_for_the_next_cooldown(monkeypatch):
+    calls = []
+    def deleted(url):
+        calls.append(url)
+        raise Exception('Failed to fetch Instagram post: 404')
+    router = app.StrategyRouter('test', {'first': deleted})
+    router.last_good_url = 'https://example.com/p/deleted'
+    router.open_until['first'] = app.time.time() - 1
+
+    router.probe_expired()
+    router.probe_expired()
+
+    assert calls == ['https://example.com/p/deleted']
+    assert router.last_good_url is None
+    assert router.open_until['first'] > app.time.time()
+
+def test_fragment_slots_cut_by_host_limit_keep_learned_concurrency(monkeypatch):
+    monkeypatch.setattr(app, 'FRAGMENT_START_CONCURRENCY', 8)
+    monkeypatch.setattr(app, 'FRAGMENT_HOST_LIMIT', 9)
+    tuner = app.FragmentTuner()
+
+    first = tuner.acquire('cdn.example.com')
+    squeezed = tuner.acquire('cdn.example.com')
+    assert (first, squeezed) == (8, 1)
+
+    tuner.release('cdn.example.com', first, 8000, 0)
+    assert tuner.hosts['cdn.example.com']['concurrency'] == 9
+    # One slot at the same per-slot rate must not reset the host to 2
+    tuner.release('cdn.example.com', squeezed, 1000, 0)
+    assert tuner.hosts['cdn.example.com']['concurrency'] >= 9
+
+def test_fragment_host_limit_of_zero_is_no_cap(monkeypatch):
+    monkeypatch.setattr(app, 'FRAGMENT_HOST_LIMIT', 0)
+    tuner = app.FragmentTuner()
+
+    assert [tuner.acquire('cdn.example.com') for _ in range(3)] == [app.FRAGMENT_START_CONCURRENCY] * 3
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('yt_dlp')
+pytest.importorskip('cloudscraper')
+pytest.importorskip('PIL')
+
+import app
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return app.SQLiteJobQueue(tmp_path / 'jobs.sqlite3')
+
+def test_claim_takes_each_job_once(job_queue):
+    job_queue.enqueue('job-1', {'url': 'https://example.com/watch'})
+
+    assert job_queue.claim('worker-a') == {'url': 'https://example.com/watch', 'id': 'job-1'}
+    assert job_queue.claim('worker-b') is None
+    assert job_queue.depth() == 0
+
+def test_job_queued_longer_than_the_lease_is_not_stale(job_queue, monkeypatch):
+    job_queue.enqueue('job-1', {'url': 'https://example.com/watch'})
+    now = app.time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: now + app.JOB_LEASE * 2)
+
+    assert job_queue.claim('worker-a')['id'] == 'job-1'
+    assert job_queue.claim('worker-b') is None
+
+def test_expired_lease_moves_job_to_another_worker(job_queue, monkeypatch):
+    job_queue.enqueue('job-1', {'url': 'https://example.com/watch'})
+    job_queue.claim('worker-a')
+    assert job_queue.update('job-1', 'worker-a', {'status': 'downloading', 'progress': 10})
+
+    now = app.time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: now + app.JOB_LEASE + 1)
+    assert job_queue.claim('worker-b')['id'] == 'job-1'
+
+    # The original worker can no longer overwrite the job
+    assert not job_queue.update('job-1', 'worker-a', {'status': 'completed'}, '/tmp/old', done=True)
+    assert job_queue.get('job-1') == {
+        'state': 'running',
+        'progress': {'status': 'downloading', 'progress': 10},
+        'file': None,
+    }
+
+def test_done_job_is_not_claimed_again(job_queue, monkeypatch):
+    job_queue.enqueue('job-1', {'url': 'https://example.com/watch'})
+    job_queue.claim('worker-a')
+    assert job_queue.update('job-1', 'worker-a', {'status': 'completed'}, 'downloads/job-1/video.mp4', done=True)
+
+    now = app.time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: now + app.JOB_LEASE + 1)
+    assert job_queue.claim('worker-b') is None
+    assert job_queue.get('job-1')['state'] == 'done'
+    assert job_queue.get('job-1')['file'] == 'downloads/job-1/video.mp4'
@@ -0,0 +1,107 @@
+"""Standalone download worker.
+
+Pulls download jobs from the shared job queue and runs them outside the web
+process. Start any number of workers next to the API, on the same node or on
+other nodes that share DOWNLOADS_DIR and the queue:
+
+    JOB_QUEUE_BACKEND=sqlite python -m backend.worker
+    JOB_QUEUE_BACKEND=redis JOB_QUEUE_URL=redis://queue:6379/0 python worker.py
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+# Cookies, downloads and the SQLite queue resolve relative to the backend
+# directory, exactly as they do for `python app.py`
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+if __package__:
+    from .app import (
+        download_video_advanced, download_progress, download_files, fragment_stats,
+        get_job_queue, cleanup_old_files, logger
+    )
+else:
+    from app import (
+        download_video_advanced, download_progress, download_files, fragment_stats,
+        get_job_queue, cleanup_old_files, logger
+    )
+
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4))
+WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 1.0))
+
+def run_job(job_queue, job, worker_id):
+    """Run one job, publishing its progress to the queue until it finishes"""
+    download_id = job['id']
+    logger.info(f"Starting job {download_id}: {job['url']}")
+    download_progress[download_id] = {'status': 'starting', 'progress': 0}
+
+    thread = threading.Thread(
+        target=download_video_advanced,
+        args=(job['url'], job.get('format', 'best'), job.get('title', 'video'), download_id)
+    )
+    thread.start()
+
+    # Post-processing finishes after the download thread returns, so wait for
+    # a final status rather than for the thread; every update is a heartbeat
+    while True:
+        status = download_progress.get(download_id, {})
+        done = not thread.is_alive() and status.get('status') in ('completed', 'error')
+        if not job_queue.update(download_id, worker_id, status, download_files.get(download_id), done=done):
+            # Our lease expired and another worker owns the job now
+            logger.warning(f"Lost the lease on job {download_id}, no longer publishing its status")
+            thread.join()
+            break
+        if done:
+            break
+        time.sleep(1)
+
+    download_progress.pop(download_id, None)
+    download_files.pop(download_id, None)
+    fragment_stats.pop(download_id, None)
+    logger.info(f"Finished job {download_id}: {status.get('status')}")
+
+def worker_loop(job_queue, worker_id):
+    """Claim and run jobs forever"""
+    while True:
+        try:
+            job = job_queue.claim(worker_id)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} could not claim a job: {e}")
+            job = None
+
+        if job is None:
+            time.sleep(WORKER_POLL_INTERVAL)
+            continue
+
+        try:
+            run_job(job_queue, job, worker_id)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed job {job['id']}: {e}")
+
+def main():
+    job_queue = get_job_queue()
+    if job_queue is None:
+        logger.error("Set JOB_QUEUE_BACKEND to 'sqlite' or 'redis' to run workers")
+        sys.exit(1)
+
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    logger.info(f"Worker {worker_id} started with {WORKER_CONCURRENCY} slots")
+
+    for slot in range(WORKER_CONCURRENCY):
+        threading.Thread(
+            target=worker_loop,
+            args=(job_queue, f'{worker_id}-{slot}'),
+            daemon=True
+        ).start()
+
+    try:
+        while True:
+            time.sleep(300)  # Run every 5 minutes
+            cleanup_old_files()
+    except KeyboardInterrupt:
+        logger.info(f"Worker {worker_id} stopping")
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ class LumenDownloader {
         this.videoInfo = null;
         this.downloadId = null;
         this.progressInterval = null;
+        this.retryTimer = null;
+        this.maxDownloadRetries = 5;
+        this.jobApiUrl = this.apiUrl;
         
         this.initializeElements();
         this.bindEvents();
@@ -250,19 +253,28 @@ class LumenDownloader {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ url })
+                body: JSON.stringify({ url, progressive: true })
             });
 
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
+            let data = await response.json();
             
             if (data.error) {
                 throw new Error(data.error);
             }
 
+            if (data.formats_pending) {
+                // Show the basic metadata right away, formats follow
+                this.videoInfo = data;
+                this.updateProgress(50, 'Loading formats...');
+                this.showVideoPreview(data);
+                data = await this.waitForFormats(data.info_id);
+                this.progressSection.classList.add('hidden');
+            }
+
             this.videoInfo = data;
             this.showVideoPreview(data);
             this.populateQualityOptions(data);
@@ -274,8 +286,38 @@ class LumenDownloader {
         }
     }
 
+    async waitForFormats(infoId) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 500));
+            
+            const response = await fetch(`${this.apiUrl}/info/${infoId}`);
+            const data = await response.json();
+            
+            if (!response.ok || data.error) {
+                throw new Error(data.error || `HTTP error! status: ${response.status}`);
+            }
+            if (data.status !== 'pending') {
+                return data;
+            }
+        }
+    }
+
     showVideoPreview(info) {
-        if (info.thumbnail) {
+        this.videoThumbnail.onerror = null;
+        if (info.thumbnail_key) {
+            // Served through the backend so CDN hotlink blocking doesn't apply
+            this.videoThumbnail.onerror = () => {
+                // Fall back to the origin if the thumbnail proxy fails
+                this.videoThumbnail.onerror = null;
+                if (info.thumbnail) {
+                    this.videoThumbnail.src = info.thumbnail;
+                } else {
+                    this.videoThumbnail.style.display = 'none';
+                }
+            };
+            this.videoThumbnail.src = `${this.apiUrl}/thumbnail/${info.thumbnail_key}`;
+            this.videoThumbnail.style.display = 'block';
+        } else if (info.thumbnail) {
             this.videoThumbnail.src = info.thumbnail;
             this.videoThumbnail.style.display = 'block';
         } else {
@@ -305,14 +347,11 @@ class LumenDownloader {
             this.videoQualitySelect.appendChild(option);
         });
         
-        // Populate audio formats
-        const audioFormats = formats.filter(fmt => 
-            fmt.acodec && fmt.acodec !== 'none' && !fmt.vcodec
-        );
-        audioFormats.forEach(fmt => {
+        // Populate audio formats (extracted by the backend from the best audio stream)
+        ['mp3', 'm4a'].forEach(ext => {
             const option = document.createElement('option');
-            option.value = fmt.format_id;
-            option.textContent = `${fmt.ext.toUpperCase()} Audio (${this.formatFileSize(fmt.filesize)})`;
+            option.value = ext;
+            option.textContent = `${ext.toUpperCase()} Audio`;
             this.audioQualitySelect.appendChild(option);
         });
         
@@ -344,7 +383,32 @@ class LumenDownloader {
         }
     }
 
-    async startDownload(format) {
+    estimateFileSize(format) {
+        const formats = (this.videoInfo && this.videoInfo.formats) || [];
+        const selected = formats.find(fmt => fmt.format_id === format);
+        if (selected && selected.filesize) {
+            return selected.filesize;
+        }
+        return Math.max(0, ...formats.filter(fmt => fmt.has_audio).map(fmt => fmt.filesize || 0));
+    }
+
+    scheduleRetry(format, seconds, attempt) {
+        // The server is overloaded; count down and try again automatically
+        let remaining = seconds;
+        const tick = () => {
+            if (remaining <= 0) {
+                this.retryTimer = null;
+                this.startDownload(format, attempt);
+                return;
+            }
+            this.showProgress(`Server busy, retrying in ${remaining}s...`, 0);
+            remaining -= 1;
+            this.retryTimer = setTimeout(tick, 1000);
+        };
+        tick();
+    }
+
+    async startDownload(format, attempt = 0) {
         try {
             this.showProgress('Starting download...', 0);
             
@@ -356,10 +420,21 @@ class LumenDownloader {
                 body: JSON.stringify({
                     url: this.currentUrl,
                     format: format,
-                    title: this.videoInfo.title
+                    title: this.videoInfo.title,
+                    filesize: this.estimateFileSize(format)
                 })
             });
 
+            if (response.status === 429 || response.status === 503) {
+                const data = await response.json().catch(() => ({}));
+                const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || data.retry_after || 5;
+                if (attempt < this.maxDownloadRetries) {
+                    this.scheduleRetry(format, retryAfter, attempt + 1);
+                    return;
+                }
+                throw new Error(data.error || 'Server is busy, please try again later');
+            }
+
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -370,6 +445,13 @@ class LumenDownloader {
                 throw new Error(data.error);
             }
 
+            if (data.mode === 'redirect') {
+                // Serverless deployment: fetch straight from the origin
+                this.showRedirectResult(data);
+                return;
+            }
+
+            this.jobApiUrl = data.api_url || this.apiUrl;
             this.downloadId = data.download_id;
             this.trackProgress();
             
@@ -384,7 +466,7 @@ class LumenDownloader {
         
         this.progressInterval = setInterval(async () => {
             try {
-                const response = await fetch(`${this.apiUrl}/progress/${this.downloadId}`);
+                const response = await fetch(`${this.jobApiUrl}/progress/${this.downloadId}`);
                 
                 if (!response.ok) {
                     throw new Error(`HTTP error! status: ${response.status}`);
@@ -417,7 +499,12 @@ class LumenDownloader {
     updateProgress(percentage, status) {
         this.progressFill.style.width = `${percentage}%`;
         this.progressText.textContent = `${percentage}%`;
-        this.progressStatus.textContent = status === 'downloading' ? 'Downloading...' : status;
+        const labels = {
+            downloading: 'Downloading...',
+            queued: 'Queued...',
+            processing: 'Processing...'
+        };
+        this.progressStatus.textContent = labels[status] || status;
     }
 
     handleDownloadComplete(data) {
@@ -439,13 +526,22 @@ class LumenDownloader {
         this.resultSection.classList.remove('hidden');
         
         // Set download link
-        this.downloadLink.href = `${this.apiUrl}/file/${this.downloadId}`;
+        this.downloadLink.href = `${this.jobApiUrl}/file/${this.downloadId}`;
         
         // Set file info
         this.fileName.textContent = this.videoInfo.title || 'Downloaded File';
         this.fileSize.textContent = data.filesize ? this.formatFileSize(data.filesize) : 'Unknown size';
     }
 
+    showRedirectResult(data) {
+        this.hideAllSections();
+        this.resultSection.classList.remove('hidden');
+        
+        this.downloadLink.href = data.url;
+        this.fileName.textContent = data.title || this.videoInfo.title || 'Downloaded File';
+        this.fileSize.textContent = this.formatFileSize(data.filesize);
+    }
+
     showError(message) {
         this.hideAllSections();
         this.errorSection.classList.remove('hidden');
@@ -480,6 +576,11 @@ class LumenDownloader {
             clearInterval(this.progressInterval);
             this.progressInterval = null;
         }
+        
+        if (this.retryTimer) {
+            clearTimeout(this.retryTimer);
+            this.retryTimer = null;
+        }
     }
 }
 